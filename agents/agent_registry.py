@@ -7,6 +7,10 @@ class AgentRegistry:
     def register(cls, *args, **kwargs):
         return cls.registry.register(*args, **kwargs)
     
+    @classmethod
+    def keys(cls):
+        return cls.registry.keys()
+
     @classmethod
     def get(cls, *args, **kwargs):
         return cls.registry.get(*args, **kwargs)
@@ -3,7 +3,7 @@ from dotenv import load_dotenv
 from typing import List, Optional, Dict
 from openai import OpenAI
 from backends.llm_registry import LLMRegistry
-from backends.message import Message
+from backends.message import Message, Usage
 
 load_dotenv()
 MINE_API_KEYS = os.getenv("MINE_API_KEYS")
@@ -20,6 +20,7 @@ class openAIChat:
             base_url=MINE_BASE_URL
         )
         self.model = model_name
+        self.usage = Usage()  # Cumulative token usage of this client
 
     def generate(self, messages: List[Dict]) -> str:
         """
@@ -30,5 +31,19 @@ class openAIChat:
             messages=messages,
             stream=False
         )
-        
-        return response.choices[0].message.content
\ No newline at end of file
+        self.record_usage(response.usage)
+        return response.choices[0].message.content
+
+    def record_usage(self, usage) -> Usage:
+        """
+        Add the `usage` block of a completion response to the cumulative counter.
+        """
+        call_usage = Usage(calls=1)
+        if usage is not None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            call_usage.prompt_tokens = usage.prompt_tokens or 0
+            call_usage.completion_tokens = usage.completion_tokens or 0
+            call_usage.cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+            call_usage.total_tokens = usage.total_tokens or call_usage.prompt_tokens + call_usage.completion_tokens
+        self.usage = self.usage + call_usage
+        return call_usage
\ No newline at end of file
@@ -13,8 +13,15 @@ class LLMRegistry:
         return cls.registry.keys()
 
     @classmethod
-    def get(cls, model_name: Optional[str] = None):
-        if 'deepseek' in model_name:
-            model = cls.registry.get('openAIChat', model_name)
+    def resolve(cls, model_name: Optional[str] = None) -> Optional[str]:
+        """ Registry key of the client that serves `model_name`, or None if unsupported. """
+        if model_name and 'deepseek' in model_name:
+            return 'openAIChat'
+        return None
 
-        return model
\ No newline at end of file
+    @classmethod
+    def get(cls, model_name: Optional[str] = None):
+        key = cls.resolve(model_name)
+        if key is None:
+            raise ValueError(f"Unsupported LLM: {model_name}")
+        return cls.registry.get(key, model_name)
\ No newline at end of file
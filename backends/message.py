@@ -13,4 +13,21 @@ class Status:
     started: int = 0
     in_progress: int = 0
     succeeded: int = 0
-    failed: int = 0
\ No newline at end of file
+    failed: int = 0
+
+@dataclasses.dataclass
+class Usage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    total_tokens: int = 0
+    calls: int = 0
+
+    def __add__(self, other: "Usage") -> "Usage":
+        return Usage(*(a + b for a, b in zip(dataclasses.astuple(self), dataclasses.astuple(other))))
+
+    def __sub__(self, other: "Usage") -> "Usage":
+        return Usage(*(a - b for a, b in zip(dataclasses.astuple(self), dataclasses.astuple(other))))
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
\ No newline at end of file
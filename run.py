@@ -1,7 +1,11 @@
 import argparse
 
+import os
+
 from structure.graph import Graph
-from structure.structure_mode import get_structure_mode
+from structure.semantic_cache import SemanticCache
+from structure.scheduler import PriorityScheduler
+from structure.structure_mode import STRUCTURE_MODES, get_structure_edges, load_masks, save_masks
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Run the multi-agent system.")
@@ -21,7 +25,7 @@ def parse_args():
     parser.add_argument(
         "--mode",
         type=str,
-        choices=["Debate", "FullConnected"],
+        choices=STRUCTURE_MODES,
         default="Debate",
         help="Mode of operation for the agents (default: Debate)."
     )
@@ -31,24 +35,90 @@ def parse_args():
         default=3,
         help="Number of rounds for the agents to interact (default: 3)."
     )
+    parser.add_argument(
+        "--mask_path",
+        type=str,
+        default=None,
+        help="Load spatial/temporal edges from a `.npz` mask file instead of generating them from --mode."
+    )
+    parser.add_argument(
+        "--save_mask_path",
+        type=str,
+        default=None,
+        help="Save the spatial/temporal edges used for this run to a `.npz` mask file."
+    )
+    parser.add_argument(
+        "--decision_method",
+        type=str,
+        default="FinalRefer",
+        help="Agent used as the final decision node (default: FinalRefer)."
+    )
+    parser.add_argument(
+        "--semantic_cache_path",
+        type=str,
+        default=None,
+        help="Enable the semantic task cache, persisted to this `.npz` snapshot."
+    )
+    parser.add_argument(
+        "--cache_threshold",
+        type=float,
+        default=0.97,
+        help="Minimum similarity for a semantic cache hit (default: 0.97)."
+    )
+    parser.add_argument(
+        "--token_budget",
+        type=int,
+        default=None,
+        help="Maximum tokens spent on agent rounds per task before going straight to the decision node."
+    )
+    parser.add_argument(
+        "--llm_concurrency",
+        type=int,
+        default=1,
+        help="Maximum number of agents calling the LLM at the same time (default: 1)."
+    )
     return parser.parse_args()
 
 def main():
     args = parse_args()
 
-    fixed_spatial_masks, fixed_temporal_masks = get_structure_mode(args)
+    if args.mask_path is not None:
+        num_nodes, spatial_edges, temporal_edges = load_masks(args.mask_path)
+        if num_nodes != len(args.agent_names):
+            raise ValueError(f"Mask file {args.mask_path} has {num_nodes} nodes "
+                             f"but {len(args.agent_names)} agent names were given")
+    else:
+        spatial_edges, temporal_edges = get_structure_edges(args)
+    if args.save_mask_path is not None:
+        save_masks(args.save_mask_path, len(args.agent_names), spatial_edges, temporal_edges)
+
+    semantic_cache = None
+    if args.semantic_cache_path is not None:
+        if os.path.exists(args.semantic_cache_path):
+            semantic_cache = SemanticCache.load(args.semantic_cache_path, threshold=args.cache_threshold)
+        else:
+            semantic_cache = SemanticCache(threshold=args.cache_threshold)
 
     graph = Graph(llm_name=args.llm_name,
                   agent_names=args.agent_names,
-                  fixed_spatial_masks=fixed_spatial_masks,
-                  fixed_temporal_masks=fixed_temporal_masks,
-                  rounds=args.num_rounds
+                  spatial_edges=spatial_edges,
+                  temporal_edges=temporal_edges,
+                  rounds=args.num_rounds,
+                  decision_method=args.decision_method,
+                  semantic_cache=semantic_cache,
+                  token_budget=args.token_budget,
+                  scheduler=PriorityScheduler(max_concurrency=args.llm_concurrency)
                   )
 
     # inputs = "Please expand the sentence: “A boy stands on a tall building and suddenly jumps down.”" #task1
     task = "Please help me to answer the following question: “How can I write a good essay?”" #task2
     # task = 'task2'
     graph.run(task, num_rounds=args.num_rounds)
+    print(f"Token usage: {graph.usage_report()}")
+
+    if semantic_cache is not None:
+        semantic_cache.save(args.semantic_cache_path)
+        print(f"Semantic cache: {semantic_cache.stats()}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,2 @@
+python service.py --agent_names normalAgent normalAgent normalAgent \
+--mode FullConnected --max_concurrency 4 --max_queue 16
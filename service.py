@@ -0,0 +1,294 @@
+import json
+import asyncio
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from agents.agent_registry import AgentRegistry
+from backends.llm_registry import LLMRegistry
+from backends.message import Usage
+from structure.graph import Graph
+from structure.scheduler import PriorityScheduler
+from structure.structure_mode import STRUCTURE_MODES, get_structure_edges
+
+MAX_BODY_BYTES = 1 << 20
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the multi-agent system over HTTP.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind (default: 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=8000, help="Port to bind (default: 8000).")
+    parser.add_argument(
+        "--llm_name",
+        type=str,
+        default="deepseek-ai/DeepSeek-V3",
+        help="Default LLM for requests that do not set one (default: deepseek-ai/DeepSeek-V3)."
+    )
+    parser.add_argument(
+        "--agent_names",
+        type=str,
+        nargs='+',
+        default=["normalAgent"],
+        help="Default agent names for requests that do not set them (default: ['normalAgent'])."
+    )
+    parser.add_argument("--mode", type=str, default="Debate", help="Default structure mode (default: Debate).")
+    parser.add_argument("--num_rounds", type=int, default=3, help="Default number of rounds (default: 3).")
+    parser.add_argument("--decision_method", type=str, default="FinalRefer", help="Default decision node (default: FinalRefer).")
+    parser.add_argument("--token_budget", type=int, default=None, help="Default per-task token budget (default: unlimited).")
+    parser.add_argument("--max_concurrency", type=int, default=4, help="Number of tasks run at the same time (default: 4).")
+    parser.add_argument("--llm_concurrency", type=int, default=8, help="LLM calls in flight across all tasks (default: 8).")
+    parser.add_argument("--max_queue", type=int, default=16, help="Number of admitted tasks waiting for a slot before returning 429 (default: 16).")
+    parser.add_argument("--max_agents", type=int, default=64, help="Maximum number of agents per request (default: 64).")
+    parser.add_argument("--max_rounds", type=int, default=10, help="Maximum number of rounds per request (default: 10).")
+    parser.add_argument("--max_pool_keys", type=int, default=16, help="Configurations with warm graphs kept, least recently used evicted first (default: 16).")
+    parser.add_argument("--max_idle_graphs", type=int, default=4, help="Warm graphs kept per configuration (default: 4).")
+    parser.add_argument("--warm_graphs", type=int, default=1, help="Graphs built for the default configuration at startup (default: 1).")
+    return parser.parse_args()
+
+class GraphService:
+    """
+    Long-lived async service that runs tasks on pools of warm `Graph` instances.
+    A graph keeps per-task state on its nodes, so each running task checks out its own
+    graph and returns it to the pool of its (mode, agent_names, llm_name, decision_method) key.
+    """
+    def __init__(self, defaults: Dict[str, Any], max_concurrency: int = 4, max_queue: int = 16, max_idle_graphs: int = 4,
+                 llm_concurrency: int = 8, max_agents: int = 64, max_rounds: int = 10, max_pool_keys: int = 16):
+        self.defaults = defaults
+        self.max_agents = max_agents
+        self.max_rounds = max_rounds
+        self.max_pool_keys = max_pool_keys
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_concurrency + max_queue
+        self.max_idle_graphs = max_idle_graphs
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        # Shared by every graph so the LLM quota is split fairly between concurrent tasks.
+        self.scheduler = PriorityScheduler(max_concurrency=llm_concurrency)
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.pools: 'OrderedDict[Tuple, List[Graph]]' = OrderedDict()  # Least recently used first
+        self.tasks = set()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_usage = Usage()
+
+    def parse_request(self, payload: Any) -> Dict[str, Any]:
+        if not isinstance(payload, dict):
+            raise ValueError("Request body must be a JSON object")
+        request = {**self.defaults, **{k: v for k, v in payload.items() if k in self.defaults or k == "task"}}
+        if not isinstance(request.get("task"), str) or not request["task"]:
+            raise ValueError("'task' must be a non-empty string")
+        for field in ("mode", "llm_name", "decision_method"):
+            if not isinstance(request[field], str):
+                raise ValueError(f"'{field}' must be a string")
+        if not isinstance(request["agent_names"], list) or not request["agent_names"] \
+                or not all(isinstance(name, str) for name in request["agent_names"]):
+            raise ValueError("'agent_names' must be a non-empty list of strings")
+        if len(request["agent_names"]) > self.max_agents:
+            raise ValueError(f"'agent_names' may list at most {self.max_agents} agents")
+        if not is_int(request["num_rounds"]) or not 1 <= request["num_rounds"] <= self.max_rounds:
+            raise ValueError(f"'num_rounds' must be an integer between 1 and {self.max_rounds}")
+        if request["token_budget"] is not None and (not is_int(request["token_budget"]) or request["token_budget"] < 0):
+            raise ValueError("'token_budget' must be a non-negative integer")
+
+        if request["mode"] not in STRUCTURE_MODES:
+            raise ValueError(f"Unknown mode {request['mode']!r}, expected one of {STRUCTURE_MODES}")
+        agent_keys = set(AgentRegistry.keys())
+        unknown = sorted(set(request["agent_names"]) - agent_keys)
+        if unknown:
+            raise ValueError(f"Unknown agent names: {unknown}")
+        if request["decision_method"] not in agent_keys:
+            raise ValueError(f"Unknown decision method {request['decision_method']!r}")
+        if LLMRegistry.resolve(request["llm_name"]) is None:
+            raise ValueError(f"Unsupported LLM {request['llm_name']!r}")
+        return request
+
+    @staticmethod
+    def config_key(request: Dict[str, Any]) -> Tuple:
+        return (request["mode"], tuple(request["agent_names"]), request["llm_name"], request["decision_method"])
+
+    def build_graph(self, key: Tuple) -> Graph:
+        mode, agent_names, llm_name, decision_method = key
+        spatial_edges, temporal_edges = get_structure_edges(argparse.Namespace(mode=mode, agent_names=list(agent_names)))
+        return Graph(agent_names=list(agent_names),
+                     llm_name=llm_name,
+                     rounds=self.defaults["num_rounds"],
+                     spatial_edges=spatial_edges,
+                     temporal_edges=temporal_edges,
+                     decision_method=decision_method,
+                     scheduler=self.scheduler)
+
+    async def checkout(self, key: Tuple) -> Graph:
+        pool = self.pools.get(key)
+        if pool:
+            self.pools.move_to_end(key)
+            return pool.pop()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.build_graph, key)
+
+    def checkin(self, key: Tuple, graph: Graph):
+        pool = self.pools.setdefault(key, [])
+        self.pools.move_to_end(key)
+        if len(pool) < self.max_idle_graphs:
+            pool.append(graph)
+        while len(self.pools) > self.max_pool_keys:
+            self.pools.popitem(last=False)
+
+    async def warm(self, request: Dict[str, Any], count: int):
+        key = self.config_key(request)
+        graphs = [await self.checkout(key) for _ in range(count)]
+        for graph in graphs:
+            self.checkin(key, graph)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": self.pending,
+                "max_pending": self.max_pending,
+                "max_concurrency": self.max_concurrency,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "usage": self.total_usage.to_dict(),
+                "warm_graphs": sum(len(pool) for pool in self.pools.values())}
+
+    async def run_task(self, request: Dict[str, Any], events: asyncio.Queue):
+        """ Run one task and push round/final/error events to `events`. """
+        loop = asyncio.get_running_loop()
+        key = self.config_key(request)
+
+        def on_round(round, outputs):
+            loop.call_soon_threadsafe(events.put_nowait, {"event": "round", "round": round + 1, "outputs": outputs})
+
+        try:
+            async with self.slots:
+                graph = await self.checkout(key)
+                try:
+                    answers = await loop.run_in_executor(
+                        self.executor,
+                        lambda: graph.run(request["task"], num_rounds=request["num_rounds"], on_round=on_round,
+                                          token_budget=request["token_budget"]))
+                    usage = graph.usage_report()
+                    self.total_usage = self.total_usage + graph.task_usage["task"]
+                finally:
+                    self.checkin(key, graph)
+            self.completed += 1
+            await events.put({"event": "final", "answers": answers, "usage": usage})
+        except Exception as e:
+            self.failed += 1
+            await events.put({"event": "error", "error": f"{type(e).__name__}: {e}"})
+        finally:
+            self.pending -= 1
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                method, path, headers, body = await read_request(reader)
+            except ValueError as e:
+                await send_json(writer, 413 if "too large" in str(e) else 400, {"error": str(e)})
+                return
+
+            if path == "/health":
+                await send_json(writer, 200, self.stats())
+                return
+            if path != "/run":
+                await send_json(writer, 404, {"error": f"Unknown path: {path}"})
+                return
+            if method != "POST":
+                await send_json(writer, 405, {"error": "Use POST"})
+                return
+
+            try:
+                request = self.parse_request(json.loads(body or b"{}"))
+            except ValueError as e:
+                await send_json(writer, 400, {"error": str(e)})
+                return
+
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                await send_json(writer, 429, {"error": "Server overloaded, retry later"}, {"Retry-After": "1"})
+                return
+            self.pending += 1
+
+            events: asyncio.Queue = asyncio.Queue()
+            task = asyncio.create_task(self.run_task(request, events))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+            await send_head(writer, 200, {"Content-Type": "application/x-ndjson", "Transfer-Encoding": "chunked"})
+            while True:
+                event = await events.get()
+                data = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                await writer.drain()
+                if event["event"] in ("final", "error"):
+                    break
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+def is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+async def read_request(reader: asyncio.StreamReader):
+    request_line = (await reader.readline()).decode("latin-1").split()
+    if len(request_line) != 3:
+        raise ValueError("Malformed request line")
+    method, path, _ = request_line
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise ValueError("Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise ValueError("Request body too large")
+    body = await reader.readexactly(length) if length > 0 else b""
+    return method.upper(), path.split("?", 1)[0], headers, body
+
+async def send_head(writer: asyncio.StreamWriter, status: int, headers: Dict[str, str]):
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}", "Connection: close"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+
+async def send_json(writer: asyncio.StreamWriter, status: int, payload: Any, headers: Dict[str, str] = None):
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send_head(writer, status, {"Content-Type": "application/json", "Content-Length": str(len(data)), **(headers or {})})
+    writer.write(data)
+    await writer.drain()
+
+async def serve(args):
+    defaults = {"mode": args.mode,
+                "agent_names": args.agent_names,
+                "llm_name": args.llm_name,
+                "num_rounds": args.num_rounds,
+                "decision_method": args.decision_method,
+                "token_budget": args.token_budget}
+    service = GraphService(defaults,
+                           max_concurrency=args.max_concurrency,
+                           max_queue=args.max_queue,
+                           max_idle_graphs=args.max_idle_graphs,
+                           llm_concurrency=args.llm_concurrency,
+                           max_agents=args.max_agents,
+                           max_rounds=args.max_rounds,
+                           max_pool_keys=args.max_pool_keys)
+    await service.warm(defaults, min(args.warm_graphs, args.max_idle_graphs))
+    server = await asyncio.start_server(service.handle, args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    asyncio.run(serve(parse_args()))
+
+if __name__ == "__main__":
+    main()
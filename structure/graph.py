@@ -1,37 +1,70 @@
+import json
 import time
-import torch
+import zlib
+import heapq
+import queue
+import itertools
 import shortuuid
-from typing import Dict, List, Any
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Iterable, Tuple, Callable
 from abc import ABC, abstractmethod
 from agents.agent_registry import AgentRegistry
 from agents.normal_agent import NormalAgent
 from agents.malicious_agent import MaliciousAgent
 from agents.final_decision import FinalRefer, FinalDirect, FinalMajorVote   
 from structure.node import Node
+from structure.scheduler import PriorityScheduler
+from structure.structure_mode import mask_to_edges
+from backends.message import Usage
 
 class Graph(ABC):
     def __init__(self, 
                  agent_names: List[str],
                  llm_name: str,
                  rounds: int,
-                 fixed_spatial_masks: List[List[int]],
-                 fixed_temporal_masks: List[List[int]],
-                 decision_agent: bool,
-                 decision_method: str
+                 fixed_spatial_masks: Optional[List[List[int]]] = None,
+                 fixed_temporal_masks: Optional[List[List[int]]] = None,
+                 decision_agent: bool = True,
+                 decision_method: str = "FinalRefer",
+                 spatial_edges: Optional[Iterable[Tuple[int, int]]] = None,
+                 temporal_edges: Optional[Iterable[Tuple[int, int]]] = None,
+                 semantic_cache: Optional[Any] = None,
+                 token_budget: Optional[int] = None,
+                 scheduler: Optional[PriorityScheduler] = None,
                  ):
+        """
+        The topology is given either as dense N x N masks (`fixed_*_masks`) or as
+        sparse (out_index, in_index) edge lists (`*_edges`), e.g. from `structure_mode.load_masks`.
+        An optional `semantic_cache` (see `structure.semantic_cache.SemanticCache`) lets `run`
+        return the cached final decision of a near-duplicate task without running the graph.
+        `token_budget` caps the total tokens spent on the agent rounds of one task; once it is
+        spent the remaining nodes and rounds are skipped and the decision node answers directly.
+        Ready nodes are dispatched through `scheduler`, which may be shared with other graphs to
+        cap LLM concurrency across tasks; by default nodes run one at a time.
+        """
         self.llm_name = llm_name
         self.agent_names = agent_names
         self.nodes:Dict[str,Node] = {}
-        self.potential_spatial_edges:List[List[str, str]] = []
-        self.potential_temporal_edges:List[List[str,str]] = []
-        self.fixed_spatial_masks = torch.tensor(fixed_spatial_masks).view(-1)
-        self.fixed_temporal_masks = torch.tensor(fixed_temporal_masks).view(-1)
+        self.spatial_edges = np.empty((0, 2), dtype=np.int64)
+        self.temporal_edges = np.empty((0, 2), dtype=np.int64)
         self.rounds = rounds
         self.decision_agent = decision_agent
+        self.decision_method = decision_method
         self.decision_node: Node = AgentRegistry.get(decision_method, **{"llm_name":self.llm_name})
+        self.semantic_cache = semantic_cache
+        self.token_budget = token_budget
+        self.task_usage: Dict[str, Any] = self.new_task_usage()
+        self.total_usage = Usage()  # Token usage of every task run on this graph
+        self.scheduler = scheduler if scheduler is not None else PriorityScheduler()
+
+        if spatial_edges is None:
+            spatial_edges = mask_to_edges(fixed_spatial_masks) if fixed_spatial_masks is not None else []
+        if temporal_edges is None:
+            temporal_edges = mask_to_edges(fixed_temporal_masks) if fixed_temporal_masks is not None else []
 
         self.init_node()
-        self.init_potential_edges()
+        self.init_edges(spatial_edges, temporal_edges)
 
     def connect_decision_node(self):
         for node_id in self.nodes.keys():
@@ -60,99 +93,359 @@ class Graph(ABC):
                         f"{[node.id for node in self.nodes.values()]}")
         
     def check_cycle(self, new_node, target_nodes):
-        if new_node in target_nodes:
-            return True
-        for successor in new_node.spatial_successors:
-            if self.check_cycle(successor, target_nodes):
+        stack = [new_node]
+        visited = set()
+        while stack:
+            node = stack.pop()
+            if node in target_nodes:
                 return True
+            if node in visited:
+                continue
+            visited.add(node)
+            stack.extend(node.spatial_successors)
         return False
 
-    def init_potential_edges(self):
+    @staticmethod
+    def topological_order(num_nodes: int, edges: np.ndarray) -> List[int]:
+        """
+        Kahn's topological sort over (out_index, in_index) edges without duplicates.
+        The order is shorter than `num_nodes` if the edges contain a cycle.
+        """
+        in_degree = np.bincount(edges[:, 1], minlength=num_nodes)
+        order = np.argsort(edges[:, 0], kind='stable')
+        targets = edges[order, 1]
+        starts = np.searchsorted(edges[order, 0], np.arange(num_nodes + 1))
+        ready = list(np.flatnonzero(in_degree == 0))
+        visited = []
+        while ready:
+            index = ready.pop()
+            visited.append(index)
+            successors = targets[starts[index]:starts[index + 1]]
+            in_degree[successors] -= 1
+            ready.extend(successors[in_degree[successors] == 0])
+        return visited
+
+    @staticmethod
+    def self_reachability(num_nodes: int) -> np.ndarray:
+        """
+        Bit-packed N x N reachability without edges: bit `j` of row `i` (little bit order)
+        is set if node `j` can be reached from node `i`, so only the diagonal is set.
+        """
+        reach = np.zeros((num_nodes, (num_nodes + 7) // 8), dtype=np.uint8)
+        indices = np.arange(num_nodes)
+        reach[indices, indices >> 3] = np.left_shift(1, indices & 7).astype(np.uint8)
+        return reach
+
+    @staticmethod
+    def reachability(num_nodes: int, edges: np.ndarray, order: List[int]) -> np.ndarray:
+        """
+        Bit-packed reachability (see `self_reachability`) over acyclic edges, filled in
+        reverse topological `order`.
+        """
+        reach = Graph.self_reachability(num_nodes)
+        sorted_edges = edges[np.argsort(edges[:, 0], kind='stable')]
+        starts = np.searchsorted(sorted_edges[:, 0], np.arange(num_nodes + 1))
+        for index in reversed(order):
+            successors = sorted_edges[starts[index]:starts[index + 1], 1]
+            if len(successors):
+                reach[index] |= np.bitwise_or.reduce(reach[successors], axis=0)
+        return reach
+
+    @staticmethod
+    def filter_cycles(num_nodes: int, edges: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Creates all potential edges list to the graph.
+        Add the edges in order, skipping every edge that would close a cycle.
+        Returns the mask of kept edges and the bit-packed reachability of the kept ones.
         """
-        for node1_id in self.nodes.keys():
-            for node2_id in self.nodes.keys():
-                self.potential_spatial_edges.append([node1_id,node2_id])
-                self.potential_temporal_edges.append([node1_id,node2_id])
+        reach = Graph.self_reachability(num_nodes)
+        keep = np.zeros(len(edges), dtype=bool)
+        for k, (i, j) in enumerate(edges.tolist()):
+            if reach[j, i >> 3] >> (i & 7) & 1:
+                continue
+            keep[k] = True
+            ancestors = np.flatnonzero(reach[:, i >> 3] >> (i & 7) & 1)
+            reach[ancestors] |= reach[j]
+        return keep, reach
+
+    def group_edges(self, edges: np.ndarray) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """
+        Per-node arrays of successor and predecessor nodes, each kept in edge order.
+        """
+        nodes = np.empty(len(self.nodes), dtype=object)
+        nodes[:] = list(self.nodes.values())
+        grouped = []
+        for column in (0, 1):
+            order = np.argsort(edges[:, column], kind='stable')
+            starts = np.searchsorted(edges[order, column], np.arange(len(nodes) + 1))
+            others = nodes[edges[order, 1 - column]]
+            grouped.append([others[starts[i]:starts[i + 1]] for i in range(len(nodes))])
+        return grouped[0], grouped[1]
+
+    def init_edges(self, spatial_edges: Iterable[Tuple[int, int]], temporal_edges: Iterable[Tuple[int, int]]):
+        """
+        Validate the (out_index, in_index) edges and resolve them to per-node adjacency once.
+        Self-loops and duplicates are dropped. If the spatial edges contain a cycle, they are
+        filtered once here, in order, skipping every edge that would close a cycle. A temporal
+        edge (i, j) is dropped if node i is spatially reachable from node j, which is what the
+        cycle check in `construct_temporal_connection` used to do every round.
+        """
+        num_nodes = len(self.nodes)
+        resolved = []
+        for edges in (spatial_edges, temporal_edges):
+            edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+            if edges.size and (edges.min() < 0 or edges.max() >= num_nodes):
+                raise Exception(f"Edge index out of range for {num_nodes} nodes")
+            edges = edges[edges[:, 0] != edges[:, 1]]
+            _, first = np.unique(edges[:, 0] * num_nodes + edges[:, 1], return_index=True)
+            resolved.append(edges[np.sort(first)])
+        self.spatial_edges, self.temporal_edges = resolved
+
+        order = self.topological_order(num_nodes, self.spatial_edges)
+        if len(order) == num_nodes:
+            reach = self.reachability(num_nodes, self.spatial_edges, order)
+        else:
+            keep, reach = self.filter_cycles(num_nodes, self.spatial_edges)
+            self.spatial_edges = self.spatial_edges[keep]
+
+        out_index, in_index = self.temporal_edges[:, 0], self.temporal_edges[:, 1]
+        self.temporal_edges = self.temporal_edges[(reach[in_index, out_index >> 3] >> (out_index & 7) & 1) == 0]
+
+        self.spatial_successors, self.spatial_predecessors = self.group_edges(self.spatial_edges)
+        self.temporal_successors, self.temporal_predecessors = self.group_edges(self.temporal_edges)
 
     def clear_temporal_connection(self):
         """
         Clear all the temporal connection of the nodes in the graph.
         """
-        for node_id in self.nodes.keys():
-            self.nodes[node_id].temporal_predecessors = []
-            self.nodes[node_id].temporal_successors = []
+        for node in self.nodes.values():
+            node.temporal_predecessors = {}
+            node.temporal_successors = {}
 
     def clear_spatial_connection(self):
         """
         Clear all the spatial connection of the nodes in the graph.
         """
-        for node_id in self.nodes.keys():
-            self.nodes[node_id].spatial_predecessors = []
-            self.nodes[node_id].spatial_successors = []
+        for node in self.nodes.values():
+            node.spatial_predecessors = {}
+            node.spatial_successors = {}
+        self.decision_node.spatial_predecessors = {}
 
     def construct_spatial_connection(self): 
         self.clear_spatial_connection()
-        for potential_connection, edge_mask in zip(self.potential_spatial_edges, self.fixed_spatial_masks):
-            out_node: Node = self.find_node(potential_connection[0])
-            in_node: Node = self.find_node(potential_connection[1])
-
-            if edge_mask == 1.0:  
-                if not self.check_cycle(in_node, {out_node}):  
-                    out_node.add_successor(in_node, 'spatial')
+        for node, successors, predecessors in zip(self.nodes.values(), self.spatial_successors, self.spatial_predecessors):
+            node.spatial_successors = dict.fromkeys(successors)
+            node.spatial_predecessors = dict.fromkeys(predecessors)
 
     def construct_temporal_connection(self, round: int = 0): 
         self.clear_temporal_connection()
         if round == 0:
             return 
 
-        for potential_connection, edge_mask in zip(self.potential_temporal_edges, self.fixed_temporal_masks):
-            out_node: Node = self.find_node(potential_connection[0])
-            in_node: Node = self.find_node(potential_connection[1])
+        for node, successors, predecessors in zip(self.nodes.values(), self.temporal_successors, self.temporal_predecessors):
+            node.temporal_successors = dict.fromkeys(successors)
+            node.temporal_predecessors = dict.fromkeys(predecessors)
+
+    @staticmethod
+    def new_task_usage() -> Dict[str, Any]:
+        return {"nodes": {}, "rounds": [], "decision": Usage(), "task": Usage(), "budget_exhausted": False}
+
+    def record_usage(self, usage: Usage, node_id: Optional[str] = None, round: Optional[int] = None):
+        if round is None:
+            self.task_usage["decision"] = self.task_usage["decision"] + usage
+        else:
+            self.task_usage["nodes"][node_id] = self.task_usage["nodes"].get(node_id, Usage()) + usage
+            self.task_usage["rounds"][round] = self.task_usage["rounds"][round] + usage
+        self.task_usage["task"] = self.task_usage["task"] + usage
+        self.total_usage = self.total_usage + usage
 
-            if edge_mask == 1.0:   
-                if not self.check_cycle(in_node, {out_node}):  
-                    out_node.add_successor(in_node, 'temporal')
+    def check_budget(self, token_budget: Optional[int]) -> bool:
+        """ Mark the task as out of budget once it has spent `token_budget` tokens. """
+        if token_budget is not None and self.task_usage["task"].total_tokens >= token_budget:
+            self.task_usage["budget_exhausted"] = True
+        return self.task_usage["budget_exhausted"]
+
+    def cache_config(self, num_rounds: int) -> str:
+        """ Key of everything besides the task that decides the final answer, for the semantic cache. """
+        return json.dumps({"agent_names": list(self.agent_names),
+                           "llm_name": self.llm_name,
+                           "decision_method": self.decision_method,
+                           "num_rounds": num_rounds,
+                           "spatial_edges": zlib.crc32(self.spatial_edges.tobytes()),
+                           "temporal_edges": zlib.crc32(self.temporal_edges.tobytes())})
+
+    def usage_report(self) -> Dict[str, Any]:
+        """ JSON-friendly view of `task_usage` for the last task. """
+        return {"nodes": {node_id: usage.to_dict() for node_id, usage in self.task_usage["nodes"].items()},
+                "rounds": [usage.to_dict() for usage in self.task_usage["rounds"]],
+                "decision": self.task_usage["decision"].to_dict(),
+                "task": self.task_usage["task"].to_dict(),
+                "budget_exhausted": self.task_usage["budget_exhausted"]}
 
     def update_memory(self):
         for id,node in self.nodes.items():
             node.update_memory()
 
-    def run(self, inputs: Any, num_rounds:int, max_tries: int = 1):
+    def critical_paths(self, in_degree: Dict[str, int]) -> Dict[str, float]:
+        """
+        Estimated latency of the longest spatial path starting at each node of a round.
+        """
+        order = []
+        remaining = dict(in_degree)
+        ready = [node_id for node_id, deg in remaining.items() if deg == 0]
+        while ready:
+            node_id = ready.pop()
+            order.append(node_id)
+            for successor in self.nodes[node_id].spatial_successors:
+                if successor.id not in remaining:
+                    continue
+                remaining[successor.id] -= 1
+                if remaining[successor.id] == 0:
+                    ready.append(successor.id)
+        paths = {}
+        for node_id in reversed(order):
+            node = self.nodes[node_id]
+            paths[node_id] = self.scheduler.estimate(node) + max(
+                (paths[successor.id] for successor in node.spatial_successors if successor.id in paths), default=0.0)
+        return paths
+
+    def execute_node(self, node_id: str, inputs: Any, max_tries: int, task: Any, priority: float, done: queue.Queue):
+        """
+        Run one node in a worker thread, then report it on `done` and release its scheduler slot.
+        The slot is handed back while backing off between tries and re-acquired for the retry.
+        """
+        node = self.nodes[node_id]
+        usage = Usage()
+        holds_slot = True
+        try:
+            for tries in range(max_tries):
+                if not holds_slot:
+                    self.scheduler.acquire(task, priority)
+                    holds_slot = True
+                start = time.time()
+                try:
+                    node.execute(inputs)  # Execute the node
+                    self.scheduler.observe(node, time.time() - start)
+                    break
+                except Exception as e:
+                    print(f"Error during execution of node {node_id}: {e}")
+                finally:
+                    usage = usage + node.last_usage
+                if tries + 1 < max_tries:
+                    self.scheduler.release(task)
+                    holds_slot = False
+                    time.sleep(60)  # Wait before retrying
+        finally:
+            done.put((node_id, usage))
+            if holds_slot:
+                self.scheduler.release(task)
+
+    def execute_round(self, inputs: Any, round: int, in_degree: Dict[str, int], critical_paths: Dict[str, float],
+                      remaining_after_round: float, max_tries: int, token_budget: Optional[int], task: Any):
+        """
+        Execute the nodes of one round in topological order, dispatching the ready node with
+        the longest remaining critical path whenever the scheduler grants a slot.
+        """
+        counter = itertools.count()
+        ready = [(-critical_paths[node_id], next(counter), node_id) for node_id, deg in in_degree.items() if deg == 0]
+        heapq.heapify(ready)
+        done: queue.Queue = queue.Queue()
+        running = 0
+
+        def complete(node_id: str, usage: Usage):
+            self.record_usage(usage, node_id, round)
+            self.check_budget(token_budget)
+            for successor in self.nodes[node_id].spatial_successors:
+                if successor.id not in self.nodes.keys():
+                    continue
+                in_degree[successor.id] -= 1
+                if in_degree[successor.id] == 0:
+                    heapq.heappush(ready, (-critical_paths[successor.id], next(counter), successor.id))
+
+        # Nodes backing off between tries keep a thread but not a scheduler slot, so the pool
+        # is sized by the round rather than the slot count; threads are still started lazily.
+        with ThreadPoolExecutor(max_workers=max(1, len(self.nodes))) as executor:
+            while True:
+                while not done.empty():
+                    complete(*done.get())
+                    running -= 1
+                if self.task_usage["budget_exhausted"] or not ready:
+                    if not running:
+                        break
+                    complete(*done.get())
+                    running -= 1
+                    continue
+                self.scheduler.acquire(task, remaining_after_round - ready[0][0])
+                # Nodes finished while waiting may have made a longer path ready.
+                while not done.empty():
+                    complete(*done.get())
+                    running -= 1
+                if self.task_usage["budget_exhausted"]:
+                    self.scheduler.release(task)
+                    continue
+                _, _, node_id = heapq.heappop(ready)
+                executor.submit(self.execute_node, node_id, inputs, max_tries, task,
+                                remaining_after_round + critical_paths[node_id], done)
+                running += 1
+
+    def run(self, inputs: Any, num_rounds:int, max_tries: int = 1,
+            on_round: Optional[Callable[[int, Dict[str, List[Any]]], None]] = None,
+            token_budget: Optional[int] = None):
+        """
+        Run the graph for `num_rounds` rounds and return the final answers of the decision node.
+        `on_round(round, outputs)` is called after each round with the outputs of every node.
+        Token usage per node, round and task is left in `self.task_usage`.
+        """
+        token_budget = self.token_budget if token_budget is None else token_budget
+        self.task_usage = self.new_task_usage()
+        for node in [*self.nodes.values(), self.decision_node]:
+            node.outputs = []
+
+        if self.decision_agent and self.semantic_cache is not None:
+            cached_answers = self.semantic_cache.lookup(inputs, self.cache_config(num_rounds))
+            if cached_answers is not None:
+                self.decision_node.outputs = list(cached_answers)
+                print(f"Final Answer (cached): {self.decision_node.outputs}")
+                return self.decision_node.outputs
+
+        task = object()  # Identifies this task to the shared scheduler
+        self.construct_spatial_connection()  # Spatial connections are the same in every round
         for round in range(num_rounds):
+            if self.check_budget(token_budget):  # Also stops a budget of 0 before any agent runs
+                print(f"Token budget of {token_budget} spent, skipping the remaining rounds")
+                break
             print(f"==== Round {round + 1} ====")
-            self.construct_spatial_connection()
-            self.construct_temporal_connection(round)
+            self.task_usage["rounds"].append(Usage())
+            if round <= 1:  # Temporal connections are the same in every round after the first
+                self.construct_temporal_connection(round)
 
             in_degree = {node_id: len(node.spatial_predecessors) for node_id, node in self.nodes.items()}
-            zero_in_degree_queue = [node_id for node_id, deg in in_degree.items() if deg == 0]
-
-            while zero_in_degree_queue:
-                current_node_id = zero_in_degree_queue.pop(0)
-                tries = 0
-                while tries < max_tries:
-                    try:
-                        self.nodes[current_node_id].execute(inputs)  # Execute the node
-                        break
-                    except Exception as e:
-                        print(f"Error during execution of node {current_node_id}: {e}")
-                        time.sleep(60)  # Wait before retrying
-                    tries += 1
-                for successor in self.nodes[current_node_id].spatial_successors:
-                    if successor.id not in self.nodes.keys():
-                        continue
-                    in_degree[successor.id] -= 1
-                    if in_degree[successor.id] == 0:
-                        zero_in_degree_queue.append(successor.id)
+            critical_paths = self.critical_paths(in_degree)
+            # Rounds are separated by a barrier, so every later round adds its own critical path.
+            remaining_after_round = (num_rounds - round - 1) * max(critical_paths.values(), default=0.0)
+            if self.decision_agent:
+                remaining_after_round += self.scheduler.estimate(self.decision_node)
+            self.execute_round(inputs, round, in_degree, critical_paths, remaining_after_round,
+                               max_tries, token_budget, task)
 
             self.update_memory()  # Update memory after each round
+            if on_round is not None:
+                on_round(round, {node_id: list(node.outputs) for node_id, node in self.nodes.items()})
 
         if self.decision_agent:
             self.connect_decision_node()
-            self.decision_node.execute(inputs)
+            self.scheduler.acquire(task, self.scheduler.estimate(self.decision_node))
+            start = time.time()
+            try:
+                self.decision_node.execute(inputs)
+                self.scheduler.observe(self.decision_node, time.time() - start)
+            finally:
+                self.scheduler.release(task)
+                self.record_usage(self.decision_node.last_usage)
             final_answers = self.decision_node.outputs
             if len(final_answers) == 0:
                 final_answers.append("No answer of the decision node")
             else:
                 print(f"Final Answer: {final_answers}")
+                if self.semantic_cache is not None and not self.task_usage["budget_exhausted"]:
+                    self.semantic_cache.add(inputs, list(final_answers), self.cache_config(num_rounds))
+            return final_answers
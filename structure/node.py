@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import Optional, List, Dict, Any
 import shortuuid
+from backends.message import Usage
 
 class Node(ABC):
     def __init__(self, 
@@ -12,16 +13,17 @@ class Node(ABC):
         self.agent_name = agent_name
         self.llm_name = llm_name
 
-        # Spatial and temporal relationships
-        self.spatial_predecessors: List[Node] = []
-        self.spatial_successors: List[Node] = []
-        self.temporal_predecessors: List[Node] = []
-        self.temporal_successors: List[Node] = []
+        # Spatial and temporal relationships, kept as insertion-ordered dicts for O(1) membership
+        self.spatial_predecessors: Dict[Node, None] = {}
+        self.spatial_successors: Dict[Node, None] = {}
+        self.temporal_predecessors: Dict[Node, None] = {}
+        self.temporal_successors: Dict[Node, None] = {}
         self.inputs: List[Any] = []
         self.outputs: List[Any] = []
         self.raw_inputs: List[Any] = []
         self.role = ""
         self.last_memory: Dict[str,List[Any]] = {'inputs':[],'outputs':[],'raw_inputs':[]}        
+        self.last_usage = Usage()  # Token usage of the latest execute call
 
     @property
     def node_name(self):
@@ -29,41 +31,41 @@ class Node(ABC):
     
     def add_predecessor(self, operation: 'Node', st='spatial'):
         if st == 'spatial' and operation not in self.spatial_predecessors:
-            self.spatial_predecessors.append(operation)
-            operation.spatial_successors.append(self)
+            self.spatial_predecessors[operation] = None
+            operation.spatial_successors[self] = None
         elif st == 'temporal' and operation not in self.temporal_predecessors:
-            self.temporal_predecessors.append(operation)
-            operation.temporal_successors.append(self)
+            self.temporal_predecessors[operation] = None
+            operation.temporal_successors[self] = None
 
     def add_successor(self, operation: 'Node', st='spatial'):
         if st =='spatial' and operation not in self.spatial_successors:
-            self.spatial_successors.append(operation)
-            operation.spatial_predecessors.append(self)
+            self.spatial_successors[operation] = None
+            operation.spatial_predecessors[self] = None
         elif st == 'temporal' and operation not in self.temporal_successors:
-            self.temporal_successors.append(operation)
-            operation.temporal_predecessors.append(self)
+            self.temporal_successors[operation] = None
+            operation.temporal_predecessors[self] = None
 
     def remove_predecessor(self, operation: 'Node', st='spatial'):
         if st =='spatial' and operation in self.spatial_predecessors:
-            self.spatial_predecessors.remove(operation)
-            operation.spatial_successors.remove(self)
+            del self.spatial_predecessors[operation]
+            del operation.spatial_successors[self]
         elif st =='temporal' and operation in self.temporal_predecessors:
-            self.temporal_predecessors.remove(operation)
-            operation.temporal_successors.remove(self)
+            del self.temporal_predecessors[operation]
+            del operation.temporal_successors[self]
 
     def remove_successor(self, operation: 'Node', st='spatial'):
         if st =='spatial' and operation in self.spatial_successors:
-            self.spatial_successors.remove(operation)
-            operation.spatial_predecessors.remove(self)
+            del self.spatial_successors[operation]
+            del operation.spatial_predecessors[self]
         elif st =='temporal' and operation in self.temporal_successors:
-            self.temporal_successors.remove(operation)
-            operation.temporal_predecessors.remove(self)
+            del self.temporal_successors[operation]
+            del operation.temporal_predecessors[self]
 
     def clear_connections(self):
-        self.spatial_predecessors: List[Node] = []
-        self.spatial_successors: List[Node] = []
-        self.temporal_predecessors: List[Node] = []
-        self.temporal_successors: List[Node] = []        
+        self.spatial_predecessors: Dict[Node, None] = {}
+        self.spatial_successors: Dict[Node, None] = {}
+        self.temporal_predecessors: Dict[Node, None] = {}
+        self.temporal_successors: Dict[Node, None] = {}
     
     def update_memory(self):
         self.last_memory['inputs'] = self.inputs
@@ -101,11 +103,19 @@ class Node(ABC):
         
         return temporal_info
     
+    def get_llm_usage(self) -> Usage:
+        llm_usage = getattr(getattr(self, 'llm', None), 'usage', None)
+        return llm_usage if llm_usage is not None else Usage()
+
     def execute(self, input:Any, **kwargs):
         self.outputs = []
         spatial_info:Dict[str,Dict] = self.get_spatial_info()
         temporal_info:Dict[str,Dict] = self.get_temporal_info()
-        results = [self._execute(input, spatial_info, temporal_info, **kwargs)]
+        usage_before = self.get_llm_usage()
+        try:
+            results = [self._execute(input, spatial_info, temporal_info, **kwargs)]
+        finally:
+            self.last_usage = self.get_llm_usage() - usage_before
 
         for result in results:
             if not isinstance(result, list):
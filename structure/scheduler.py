@@ -0,0 +1,64 @@
+import itertools
+import threading
+from typing import Any, Dict, List, Tuple
+
+from structure.node import Node
+
+class PriorityScheduler:
+    """
+    Shared cap on concurrent node executions across every graph and task that uses it.
+    Waiting tasks are served fairly (the task with the fewest running nodes goes first),
+    and ties are broken by the larger remaining critical path, then by arrival order.
+    Per-agent latencies are learned online with an exponential moving average and used
+    by `Graph` to compute the critical paths.
+    """
+    def __init__(self, max_concurrency: int = 1, alpha: float = 0.3, default_latency: float = 1.0):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.alpha = alpha
+        self.default_latency = default_latency
+        self.latencies: Dict[Tuple, float] = {}
+        self.in_use = 0
+        self.running: Dict[Any, int] = {}
+        self.waiting: List[List[Any]] = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    @staticmethod
+    def latency_key(node: Node) -> Tuple:
+        return (node.node_name, node.llm_name)
+
+    def estimate(self, node: Node) -> float:
+        return self.latencies.get(self.latency_key(node), self.default_latency)
+
+    def observe(self, node: Node, seconds: float):
+        key = self.latency_key(node)
+        with self.condition:
+            if key in self.latencies:
+                self.latencies[key] += self.alpha * (seconds - self.latencies[key])
+            else:
+                self.latencies[key] = seconds
+
+    def _next_waiter(self) -> List[Any]:
+        return min(self.waiting, key=lambda waiter: (self.running.get(waiter[0], 0), -waiter[1], waiter[2]))
+
+    def acquire(self, task: Any, priority: float):
+        """ Block until `task` is granted an execution slot. """
+        with self.condition:
+            waiter = [task, priority, next(self.counter)]
+            self.waiting.append(waiter)
+            while self.in_use >= self.max_concurrency or self._next_waiter() is not waiter:
+                self.condition.wait()
+            self.waiting.remove(waiter)
+            self.in_use += 1
+            self.running[task] = self.running.get(task, 0) + 1
+            self.condition.notify_all()
+
+    def release(self, task: Any):
+        with self.condition:
+            self.in_use -= 1
+            self.running[task] -= 1
+            if self.running[task] == 0:
+                del self.running[task]
+            self.condition.notify_all()
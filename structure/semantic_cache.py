@@ -0,0 +1,201 @@
+import re
+import json
+import zlib
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Words that may be added or dropped without changing the question. Anything that can
+# change the meaning (prepositions, conjunctions, pronouns, negations, numbers) is not filler.
+FILLER_WORDS = frozenset(["a", "an", "the", "please", "kindly", "just"])
+
+class SemanticCache:
+    """
+    Approximate task-level cache for `Graph.run`.
+    Tasks are embedded with hashed word and character n-grams, and a lookup returns the
+    cached final decision of the most similar stored task if its cosine similarity
+    reaches `threshold`. Entries are only matched against lookups with the same `config`
+    (the graph configuration), so one snapshot can be shared between topologies and models.
+
+    Hashed trigrams score templated questions that differ in a single entity, number or
+    negation around 0.85-0.97, and reordered questions even higher, so the similarity alone
+    cannot tell them apart. The default threshold is a strict 0.97, and a candidate above it
+    must also pass `words_match`: after dropping `FILLER_WORDS`, both tasks must consist of
+    the same words in the same order. Among others, these pairs are misses:
+
+        "Does the dog bite the man?"                 / "Does the man bite the dog?"
+        "Should I sell my stock and buy bonds now?"  / "Should I sell my bonds and buy stock now?"
+        "Is the cat chasing the mouse?"              / "Is the mouse chasing the cat?"
+        "Translate from English to French: ..."      / "Translate from French to English: ..."
+        "What is 1234567 squared?"                   / "What is 1234568 squared?"
+        "Why did the Roman Empire fall?"             / "Why did the Ottoman Empire fall?"
+
+    In practice this is a normalised exact-match cache, not a paraphrase cache: it tolerates
+    differences in case, punctuation and whitespace, plus an added or dropped filler word in
+    tasks long enough to stay above the threshold. Rephrasings miss, e.g. "How do I write a
+    good essay?" and "How can I write a good essay?".
+    """
+    def __init__(self,
+                 threshold: float = 0.97,
+                 dim: int = 1024,
+                 ngram: int = 3,
+                 max_entries: Optional[int] = None,
+                 audit_size: int = 1000,
+                 ):
+        self.threshold = threshold
+        self.dim = dim
+        self.ngram = ngram
+        self.max_entries = max_entries
+        self.keys = np.zeros((0, dim), dtype=np.float32)
+        self.config_ids = np.zeros(0, dtype=np.int32)
+        self.config_names: Dict[Optional[str], int] = {}
+        self.tasks: List[Optional[str]] = []
+        self.values: List[Any] = []
+        self.configs: List[Optional[str]] = []
+        self.size = 0
+        self.next_index = 0
+        self.lookups = 0
+        self.hits = 0
+        self.false_hits = 0
+        self.audit_log: deque = deque(maxlen=audit_size)
+
+    @staticmethod
+    def normalize(task: str) -> str:
+        task = re.sub(r"[^\w\s]", " ", str(task).lower())
+        return " ".join(task.split())
+
+    def embed(self, task: str) -> np.ndarray:
+        """ Embed a task as an L2-normalised bag of hashed n-grams. """
+        text = self.normalize(task)
+        features = text.split()
+        padded = f" {text} "
+        features += [padded[i:i + self.ngram] for i in range(max(len(padded) - self.ngram + 1, 0))]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if not features:
+            return vector
+        hashes = np.array([zlib.crc32(feature.encode("utf-8")) for feature in features], dtype=np.uint64)
+        signs = np.where(hashes & np.uint64(1 << 31), -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, (hashes % np.uint64(self.dim)).astype(np.int64), signs)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    @classmethod
+    def content_words(cls, task: str) -> List[str]:
+        return [word for word in cls.normalize(task).split() if word not in FILLER_WORDS]
+
+    @classmethod
+    def words_match(cls, task: str, other: str) -> bool:
+        """ True if the two tasks have the same words in the same order, apart from filler words. """
+        return cls.content_words(task) == cls.content_words(other)
+
+    def _search(self, task: str, config: Optional[str], max_candidates: int = 8):
+        if self.size == 0 or config not in self.config_names:
+            return None, 0.0
+        similarities = self.keys[:self.size] @ self.embed(task)
+        similarities[self.config_ids[:self.size] != self.config_names[config]] = -np.inf
+        candidates = np.flatnonzero(similarities >= self.threshold)
+        candidates = candidates[np.argsort(-similarities[candidates], kind='stable')[:max_candidates]]
+        for index in candidates.tolist():
+            if self.tasks[index] is not None and self.words_match(task, self.tasks[index]):
+                return index, float(similarities[index])
+        return None, 0.0
+
+    def lookup(self, task: str, config: Optional[str] = None) -> Optional[Any]:
+        """ Return the cached value for a near-duplicate task under `config`, or None on a miss. """
+        self.lookups += 1
+        index, similarity = self._search(task, config)
+        if index is None:
+            return None
+        self.hits += 1
+        self.audit_log.append({"task": task,
+                               "matched_task": self.tasks[index],
+                               "similarity": similarity,
+                               "index": index})
+        return self.values[index]
+
+    def add(self, task: str, value: Any, config: Optional[str] = None):
+        vector = self.embed(task)
+        if self.max_entries is not None and self.size >= self.max_entries:
+            # Overwrite the oldest entry once the cache is full.
+            index = self.next_index
+            self.next_index = (self.next_index + 1) % self.max_entries
+        else:
+            index = self.size
+            if index >= len(self.keys):
+                capacity = max(16, 2 * len(self.keys))
+                if self.max_entries is not None:
+                    capacity = min(capacity, self.max_entries)
+                keys = np.zeros((capacity, self.dim), dtype=np.float32)
+                keys[:self.size] = self.keys[:self.size]
+                self.keys = keys
+                config_ids = np.zeros(capacity, dtype=np.int32)
+                config_ids[:self.size] = self.config_ids[:self.size]
+                self.config_ids = config_ids
+            self.tasks.append(None)
+            self.values.append(None)
+            self.configs.append(None)
+            self.size += 1
+        self.keys[index] = vector
+        self.config_ids[index] = self.config_names.setdefault(config, len(self.config_names))
+        self.tasks[index] = task
+        self.values[index] = value
+        self.configs[index] = config
+
+    def report_false_hit(self, task: str, invalidate: bool = True) -> bool:
+        """
+        Record that the last hit for `task` returned a wrong answer.
+        The matched entry is dropped from the cache unless `invalidate` is False.
+        """
+        for record in reversed(self.audit_log):
+            if record["task"] != task:
+                continue
+            record["false_hit"] = True
+            self.false_hits += 1
+            index = record["index"]
+            if invalidate and self.tasks[index] == record["matched_task"]:
+                self.keys[index] = 0.0
+                self.tasks[index] = None
+                self.values[index] = None
+            return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": sum(task is not None for task in self.tasks),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "misses": self.lookups - self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "false_hits": self.false_hits,
+                "false_hit_rate": self.false_hits / self.hits if self.hits else 0.0}
+
+    def save(self, path: str):
+        """ Persist a snapshot of the cache to a compressed `.npz` file. """
+        meta = {"threshold": self.threshold,
+                "dim": self.dim,
+                "ngram": self.ngram,
+                "max_entries": self.max_entries,
+                "next_index": self.next_index,
+                "tasks": self.tasks,
+                "values": self.values,
+                "configs": self.configs}
+        np.savez_compressed(path, keys=self.keys[:self.size], meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path: str, threshold: Optional[float] = None) -> 'SemanticCache':
+        with np.load(path) as data:
+            keys = data["keys"]
+            meta = json.loads(str(data["meta"]))
+        cache = cls(threshold=meta["threshold"] if threshold is None else threshold,
+                    dim=meta["dim"],
+                    ngram=meta["ngram"],
+                    max_entries=meta["max_entries"])
+        cache.keys = keys.astype(np.float32)
+        cache.tasks = meta["tasks"]
+        cache.values = meta["values"]
+        cache.configs = meta["configs"]
+        cache.config_ids = np.array([cache.config_names.setdefault(config, len(cache.config_names))
+                                     for config in cache.configs], dtype=np.int32)
+        cache.size = len(cache.tasks)
+        cache.next_index = meta["next_index"]
+        return cache
@@ -1,61 +1,140 @@
-import random
+import numpy as np
+
+# Edges are stored as an (E, 2) int32 array of (out_index, in_index) pairs,
+# so memory grows with the number of edges instead of N^2.
+EDGE_DTYPE = np.int32
+
+STRUCTURE_MODES = ["Debate", "FullConnected", "Random", "Layered", "Mesh", "Star", "Chain", "DirectAnswer"]
+
+def _empty_edges():
+    return np.empty((0, 2), dtype=EDGE_DTYPE)
+
+def _stack_edges(src, dst):
+    return np.stack([np.asarray(src, dtype=EDGE_DTYPE), np.asarray(dst, dtype=EDGE_DTYPE)], axis=1)
+
+def generate_full_edges(N, self_loops=True):
+    src, dst = np.divmod(np.arange(N * N, dtype=np.int64), N)
+    if not self_loops:
+        keep = src != dst
+        src, dst = src[keep], dst[keep]
+    return _stack_edges(src, dst)
+
+def generate_layered_edges(N, layer_num=2):
+    sizes = np.full(layer_num, N // layer_num)
+    sizes[:N % layer_num] += 1
+    starts = np.concatenate(([0], np.cumsum(sizes)))
+    edges = [_empty_edges()]
+    for i in range(layer_num - 1):
+        src = np.arange(starts[i], starts[i + 1])
+        dst = np.arange(starts[i + 1], starts[i + 2])
+        edges.append(_stack_edges(np.repeat(src, len(dst)), np.tile(dst, len(src))))
+    return np.concatenate(edges)
+
+def generate_mesh_edges(N):
+    src, dst = np.triu_indices(N, k=1)
+    return _stack_edges(src, dst)
+
+def generate_star_edges(N):
+    dst = np.arange(1, N)
+    return _stack_edges(np.zeros_like(dst), dst)
+
+def generate_chain_edges(N):
+    src = np.arange(max(N - 1, 0))
+    return _stack_edges(src, src + 1)
+
+def generate_random_edges(N, self_loops=True, rng=None):
+    rng = np.random.default_rng() if rng is None else rng
+    mask = rng.integers(0, 2, size=(N, N), dtype=np.int8).astype(bool)
+    if not self_loops:
+        np.fill_diagonal(mask, False)
+    return np.argwhere(mask).astype(EDGE_DTYPE)
+
+def edges_to_mask(edges, N):
+    """
+    Convert an (E, 2) edge array into a dense N x N adjacency list.
+    """
+    mask = np.zeros((N, N), dtype=np.int64)
+    edges = np.asarray(edges, dtype=EDGE_DTYPE).reshape(-1, 2)
+    mask[edges[:, 0], edges[:, 1]] = 1
+    return mask.tolist()
+
+def mask_to_edges(mask):
+    """
+    Convert a dense adjacency matrix into an (E, 2) edge array.
+    """
+    return np.argwhere(np.asarray(mask) != 0).astype(EDGE_DTYPE).reshape(-1, 2)
+
+def save_masks(path, num_nodes, spatial_edges, temporal_edges):
+    """
+    Save spatial and temporal edges in the compressed `.npz` mask format read by `load_masks`.
+    """
+    np.savez_compressed(path,
+                        num_nodes=np.int64(num_nodes),
+                        spatial_edges=np.asarray(spatial_edges, dtype=EDGE_DTYPE).reshape(-1, 2),
+                        temporal_edges=np.asarray(temporal_edges, dtype=EDGE_DTYPE).reshape(-1, 2))
+
+def load_masks(path):
+    """
+    Load a mask file written by `save_masks`.
+    Returns (num_nodes, spatial_edges, temporal_edges).
+    """
+    with np.load(path) as data:
+        num_nodes = int(data['num_nodes'])
+        spatial_edges = data['spatial_edges'].astype(EDGE_DTYPE).reshape(-1, 2)
+        temporal_edges = data['temporal_edges'].astype(EDGE_DTYPE).reshape(-1, 2)
+    for edges in (spatial_edges, temporal_edges):
+        if edges.size and (edges.min() < 0 or edges.max() >= num_nodes):
+            raise ValueError(f"Edge index out of range for {num_nodes} nodes in {path}")
+    return num_nodes, spatial_edges, temporal_edges
 
 def generate_layered_graph(N,layer_num=2):
-        adj_matrix = [[0]*N for _ in range(N)]
-        base_size = N // layer_num
-        remainder = N % layer_num
-        layers = []
-        for i in range(layer_num):
-            size = base_size + (1 if i < remainder else 0)
-            layers.extend([i] * size)
-        # random.shuffle(layers)
-        for i in range(N):
-            current_layer = layers[i]
-            for j in range(N):
-                if layers[j] == current_layer + 1:
-                    adj_matrix[i][j] = 1
-        return adj_matrix
+    return edges_to_mask(generate_layered_edges(N, layer_num), N)
 
 def generate_mesh_graph(N):
-        adj_matrix = [[0] * N for _ in range(N)]
-        for i in range(0, N):
-            for j in range(i+1,N):
-                adj_matrix[i][j] = 1
-        return adj_matrix
-    
+    return edges_to_mask(generate_mesh_edges(N), N)
+
 def generate_star_graph(N):
-    adj_matrix = [[0] * N for _ in range(N)]
-    for i in range(1,N):
-        adj_matrix[0][i] = 1
-    return adj_matrix
+    return edges_to_mask(generate_star_edges(N), N)
 
-def get_structure_mode(args):
+def get_structure_edges(args):
+    """
+    Build the sparse (spatial_edges, temporal_edges) of the topology selected by `args.mode`.
+    """
     N = len(args.agent_names)
-    
+
     if args.mode == 'Debate':
-        fixed_spatial_masks = [[0 for i in range(N)] for j in range(N)]
-        fixed_temporal_masks = [[1 for i in range(N)] for j in range(N)]
+        spatial_edges = _empty_edges()
+        temporal_edges = generate_full_edges(N)
     elif args.mode == 'FullConnected':
-        fixed_spatial_masks = [[1 if i!=j else 0 for i in range(N)] for j in range(N)]
-        fixed_temporal_masks = [[1 for _ in range(N)] for _ in range(N)]
+        # The same edges the in-order cycle filter keeps from the full mask without self-loops.
+        spatial_edges = generate_mesh_edges(N)
+        temporal_edges = generate_full_edges(N)
     elif args.mode == 'Random':
-        fixed_spatial_masks = [[random.randint(0, 1)  if i!=j else 0 for i in range(N)] for j in range(N)]
-        fixed_temporal_masks = [[random.randint(0, 1) for _ in range(N)] for _ in range(N)]
+        spatial_edges = generate_random_edges(N, self_loops=False)
+        temporal_edges = generate_random_edges(N)
     elif args.mode == 'Layered':
-        fixed_spatial_masks = generate_layered_graph(N)
-        fixed_temporal_masks = [[1 for i in range(N)] for j in range(N)]
+        spatial_edges = generate_layered_edges(N)
+        temporal_edges = generate_full_edges(N)
     elif args.mode == 'Mesh':
-        fixed_spatial_masks = generate_mesh_graph(N)
-        fixed_temporal_masks = [[1 for i in range(N)] for j in range(N)]
+        spatial_edges = generate_mesh_edges(N)
+        temporal_edges = generate_full_edges(N)
     elif args.mode == 'Star':
-        fixed_spatial_masks = generate_star_graph(N)
-        fixed_temporal_masks = [[1 for i in range(N)] for j in range(N)]
-    elif args.mode=='Chain':
-        fixed_spatial_masks = [[1 if i==j+1 else 0 for i in range(N)] for j in range(N)]
-        fixed_temporal_masks = [[1 if i==0 and j==N-1 else 0 for i in range(N)] for j in range(N)]
-    if args.mode=='DirectAnswer':
-        fixed_spatial_masks = [[0]]
-        fixed_temporal_masks = [[0]]
-        node_kwargs = [{'role':'Normal'}]
-
-    return fixed_spatial_masks, fixed_temporal_masks
\ No newline at end of file
+        spatial_edges = generate_star_edges(N)
+        temporal_edges = generate_full_edges(N)
+    elif args.mode == 'Chain':
+        spatial_edges = generate_chain_edges(N)
+        temporal_edges = _stack_edges([N - 1], [0]) if N > 0 else _empty_edges()
+    elif args.mode == 'DirectAnswer':
+        spatial_edges = _empty_edges()
+        temporal_edges = _empty_edges()
+    else:
+        raise ValueError(f"Unknown structure mode: {args.mode}")
+
+    return spatial_edges, temporal_edges
+
+def get_structure_mode(args):
+    N = len(args.agent_names)
+    if args.mode == 'DirectAnswer':
+        return [[0]], [[0]]
+    spatial_edges, temporal_edges = get_structure_edges(args)
+    return edges_to_mask(spatial_edges, N), edges_to_mask(temporal_edges, N)